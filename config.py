@@ -6,8 +6,14 @@ NODE_VERSION = "23"
 # Konfigurasi GitHub
 GITHUB_REPO_URL = "https://github.com/username/repository.git" #your github repository
 PROJECT_DIR = "/var/www/nextjs-app" #your project directory
+GIT_FETCH_TAGS = False #repository is cloned shallow (latest commit only); set True if the build needs tags
 
 # Konfigurasi Aplikasi
 NEXT_BUILD_COMMAND = "npm run build"
 NEXT_START_COMMAND = "npm run start"
+NPM_CACHE_DIR = "~/.npm-cache" #persistent npm cache; point at a mounted volume on ephemeral runners
+NPM_IGNORE_SCRIPTS = True #applies to npm, pnpm and yarn installs; set to False if dependencies need install scripts (e.g. prisma, sharp)
 PM2_APP_NAME = "nextjs-app"
+
+# Konfigurasi Logging
+DIRECT_COMMAND_LOG = False #write command output straight to deployment.log instead of echoing it to the console
@@ -1,283 +1,1062 @@
+import asyncio
+import atexit
+import getpass
+import hashlib
+import json
 import os
 import subprocess
 import sys
 import logging
+import logging.handlers
+import queue
+import shlex
 import shutil
-from typing import Optional, List
+import time
+import urllib.request
+from pathlib import Path
+from typing import Optional, List, Dict, Tuple, Union
 
 import config
 
-# Configure logging
+LOG_FILE = 'deployment.log'
+
+# Size of the deployment.log write buffer
+LOG_BUFFER_SIZE = 64 * 1024
+
+class BufferedFileHandler(logging.FileHandler):
+    """
+    FileHandler that lets records accumulate in the file buffer instead of
+    issuing a write() per record. The buffer is flushed when it fills, on
+    WARNING and ERROR records, on records logged with extra={"flush_log": True}
+    and when logging shuts down, so a killed deployment keeps its log tail.
+    """
+
+    def __init__(self, filename: str, buffer_size: int = LOG_BUFFER_SIZE, **kwargs):
+        self.buffer_size = buffer_size
+        super().__init__(filename, **kwargs)
+
+    def _open(self):
+        return open(
+            self.baseFilename,
+            self.mode,
+            buffering=self.buffer_size,
+            encoding=self.encoding,
+            errors=self.errors
+        )
+
+    def emit(self, record: logging.LogRecord) -> None:
+        # StreamHandler.emit flushes after every record, so write directly
+        try:
+            if self.stream is None:
+                self.stream = self._open()
+            self.stream.write(self.format(record) + self.terminator)
+            if record.levelno >= logging.WARNING or getattr(record, "flush_log", False):
+                self.flush()
+        except RecursionError:
+            raise
+        except Exception:
+            self.handleError(record)
+
+# Configure logging. Records are formatted by the QueueHandler and written
+# by a background listener, keeping file and console I/O off the event loop
+log_queue = queue.Queue(-1)
+log_listener = logging.handlers.QueueListener(
+    log_queue,
+    BufferedFileHandler(LOG_FILE, delay=True),
+    logging.StreamHandler(sys.stdout)
+)
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(levelname)s: %(message)s',
-    handlers=[
-        logging.FileHandler('deployment.log'),
-        logging.StreamHandler(sys.stdout)
-    ]
+    handlers=[logging.handlers.QueueHandler(log_queue)]
+)
+log_listener.start()
+# Drain queued records before logging's own shutdown flushes the handlers
+atexit.register(log_listener.stop)
+
+def flush_logs() -> None:
+    """Wait until every queued record is written, then flush the log handlers."""
+    log_queue.join()
+    for handler in log_listener.handlers:
+        handler.flush()
+
+# Append-only descriptor that commands write their output to directly,
+# bypassing Python, when DIRECT_COMMAND_LOG is enabled
+COMMAND_LOG_FD = (
+    os.open(LOG_FILE, os.O_WRONLY | os.O_CREAT | os.O_APPEND | os.O_CLOEXEC, 0o644)
+    if config.DIRECT_COMMAND_LOG else None
 )
 
-def run_command(command: list, cwd: Optional[str] = None, check: bool = True) -> subprocess.CompletedProcess:
+# Environment lookups reused by the PM2 startup configuration.
+# getpass.getuser() reads $USER/$LOGNAME or the passwd entry, so unlike
+# os.getlogin() it works without a controlling terminal (systemd, cron, CI)
+_PATH = os.environ.get("PATH", "")
+_HOME = os.path.expanduser("~")
+_USER = getpass.getuser()
+
+# Artifacts reused across deployments (nodesource scripts, clone caches)
+CACHE_DIR = Path.home() / ".cache" / "deploy-nextjs"
+
+# Persistent clones, keyed by repository URL, that deployments fetch into
+CLONE_CACHE_DIR = CACHE_DIR / "clones"
+
+# Checkouts are shallow (no history); tags are only transferred when the
+# build needs them, e.g. for `git describe`. A fetch of a bare ref such as
+# HEAD never follows tags, so fetches ask for them explicitly
+GIT_CLONE_TAG_ARGS = [] if config.GIT_FETCH_TAGS else ["--no-tags"]
+GIT_FETCH_TAG_ARGS = ["--tags"] if config.GIT_FETCH_TAGS else ["--no-tags"]
+
+# Persistent npm tarball cache so npm installs can resolve from disk
+NPM_CACHE_DIR = Path(config.NPM_CACHE_DIR).expanduser()
+
+# Records the commit, toolchain and commands of the last successful
+# deployment in the project dir
+LAST_DEPLOY_MARKER = ".last_deploy"
+
+# Records what node_modules was installed from, inside node_modules itself
+INSTALL_KEY_MARKER = ".deploy-lockhash"
+
+# Frozen-lockfile install per package manager, in order of preference
+LOCKFILE_INSTALL_COMMANDS = [
+    ("package-lock.json", ["npm", "ci", "--prefer-offline", "--no-audit", "--no-fund"]),
+    ("pnpm-lock.yaml", ["pnpm", "install", "--frozen-lockfile", "--prefer-offline"]),
+    ("yarn.lock", ["yarn", "install", "--frozen-lockfile"]),
+]
+
+# Next.js transform caches, keyed by project path and linked into each
+# checkout so fresh clones build warm
+NEXT_BUILD_CACHE_DIR = Path.home() / ".cache" / "next-build"
+NEXT_BUILD_MAX_OLD_SPACE_MB = 4096
+
+# Share of physical memory the build's V8 heap may use, leaving the rest to
+# the OS and the build's worker processes so small VMs don't swap
+NEXT_BUILD_MEMORY_FRACTION = 0.75
+
+# apt refreshes its binary package cache on every `apt-get update`
+APT_PKGCACHE = "/var/cache/apt/pkgcache.bin"
+APT_CACHE_MAX_AGE = 3600
+
+# apt packages whose executable name differs from the package name
+APT_PACKAGE_EXECUTABLES = {
+    "software-properties-common": "add-apt-repository",
+    "nodejs": "node",
+}
+
+# Executable lookups for this run, keyed by name
+_executable_cache: Dict[str, Optional[str]] = {}
+
+# Longest single output line accepted when streaming subprocess output
+STREAM_LINE_LIMIT = 1024 * 1024
+
+async def run_command(
+    command: list,
+    cwd: Optional[Union[str, Path]] = None,
+    check: bool = True,
+    env: Optional[Dict[str, str]] = None,
+    capture: bool = False
+) -> subprocess.CompletedProcess:
     """
     Wrapper function to run shell commands with improved error handling and logging.
     
+    Output is streamed to the log line by line as the command runs, unless
+    capture is requested, in which case it is returned on the result instead.
+    With config.DIRECT_COMMAND_LOG, output goes straight to deployment.log.
+    
     Args:
         command (list): Command to execute
-        cwd (Optional[str]): Working directory for the command
+        cwd (Optional[Union[str, Path]]): Working directory for the command
         check (bool): Whether to raise an exception on command failure
+        env (Optional[Dict[str, str]]): Environment for the command (inherits ours if None)
+        capture (bool): Whether to collect stdout/stderr on the result instead of logging them
     
     Returns:
         subprocess.CompletedProcess: Result of the command execution
     """
     try:
-        logging.info(f"Executing command: {' '.join(command)}")
-        result = subprocess.run(
-            command, 
-            capture_output=True, 
-            text=True, 
-            cwd=cwd, 
-            check=check
+        # Only render the command line when INFO records are actually emitted
+        if logging.getLogger().isEnabledFor(logging.INFO):
+            logging.info("Executing command: %s", shlex.join(command))
+        if capture:
+            stdout, stderr = asyncio.subprocess.PIPE, asyncio.subprocess.PIPE
+        elif COMMAND_LOG_FD is not None:
+            # Write out queued records first so the header precedes the output
+            flush_logs()
+            stdout = stderr = COMMAND_LOG_FD
+        else:
+            stdout, stderr = asyncio.subprocess.PIPE, asyncio.subprocess.STDOUT
+
+        # Keep to plain Popen options (no preexec_fn, pass_fds or user/group
+        # switching) so CPython spawns via vfork/posix_spawn instead of a
+        # full fork that copies our page tables
+        proc = await asyncio.create_subprocess_exec(
+            *command,
+            cwd=cwd,
+            env=env,
+            close_fds=True,
+            stdout=stdout,
+            stderr=stderr,
+            limit=STREAM_LINE_LIMIT
         )
-        logging.info("Command executed successfully")
+        if capture:
+            stdout, stderr = await proc.communicate()
+            result = subprocess.CompletedProcess(
+                command,
+                proc.returncode,
+                stdout.decode(errors="replace"),
+                stderr.decode(errors="replace")
+            )
+        elif COMMAND_LOG_FD is not None:
+            # The kernel appends the output to deployment.log for us
+            await proc.wait()
+            result = subprocess.CompletedProcess(command, proc.returncode)
+        else:
+            # Log each line as it arrives instead of holding the whole output
+            dropped_long_lines = False
+            skipping_line = False
+            while True:
+                try:
+                    line = await proc.stdout.readuntil(b"\n")
+                except asyncio.IncompleteReadError as e:
+                    # Output ended, possibly without a final newline
+                    line = e.partial
+                except asyncio.LimitOverrunError as e:
+                    # Discard an overlong line a buffer at a time up to its
+                    # newline; draining keeps the child from blocking on a full pipe
+                    await proc.stdout.readexactly(e.consumed)
+                    dropped_long_lines = skipping_line = True
+                    continue
+                if skipping_line:
+                    # The tail of a discarded line
+                    skipping_line = False
+                    continue
+                if not line:
+                    break
+                # Commands may run concurrently, so tag each line with its program
+                logging.info("[%s] %s", command[0], line.decode(errors="replace").rstrip())
+            if dropped_long_lines:
+                logging.warning(f"Dropped output lines longer than {STREAM_LINE_LIMIT} bytes")
+            await proc.wait()
+            result = subprocess.CompletedProcess(command, proc.returncode)
+        if check:
+            result.check_returncode()
+        # Persist each finished command's output in case we are killed later
+        logging.info("Command executed successfully: %s", shlex.join(command), extra={"flush_log": True})
         return result
     except subprocess.CalledProcessError as e:
         logging.error(f"Command failed: {e}")
-        logging.error(f"STDOUT: {e.stdout}")
-        logging.error(f"STDERR: {e.stderr}")
+        if e.stdout:
+            logging.error(f"STDOUT: {e.stdout}")
+        if e.stderr:
+            logging.error(f"STDERR: {e.stderr}")
         raise
 
+async def run_script(
+    steps: List[str],
+    cwd: Optional[Union[str, Path]] = None,
+    sudo: bool = False
+) -> subprocess.CompletedProcess:
+    """
+    Run consecutive shell steps in a single bash process.
+    
+    Steps stop at the first failure, and bash traces each one so the log
+    keeps per-step detail.
+    
+    Args:
+        steps (List[str]): Shell commands to run in order
+        cwd (Optional[Union[str, Path]]): Working directory for the script
+        sudo (bool): Whether to run the whole script through one sudo call
+    
+    Returns:
+        subprocess.CompletedProcess: Result of the script execution
+    """
+    script = "\n".join(["set -euxo pipefail", *steps])
+    command = ["bash", "-c", script]
+    if sudo:
+        command = ["sudo", *command]
+    return await run_command(command, cwd=cwd)
+
+def scan_executables(names: List[str]) -> Dict[str, Optional[str]]:
+    """
+    Locate several executables with a single pass over PATH.
+    
+    Each PATH directory is listed once, instead of probing every directory
+    for every name as separate shutil.which calls would.
+    
+    Args:
+        names (List[str]): Names of the executables to find
+    
+    Returns:
+        Dict[str, Optional[str]]: Full path of each executable or None if not found
+    """
+    found: Dict[str, Optional[str]] = dict.fromkeys(names)
+    remaining = set(names)
+
+    for directory in os.environ.get("PATH", os.defpath).split(os.pathsep):
+        if not remaining:
+            break
+        try:
+            with os.scandir(directory or os.curdir) as entries:
+                for entry in entries:
+                    if (
+                        entry.name in remaining
+                        and entry.is_file()
+                        and os.access(entry.path, os.X_OK)
+                    ):
+                        found[entry.name] = entry.path
+                        remaining.discard(entry.name)
+        except OSError:
+            continue
+
+    return found
+
+def prime_executable_cache(names: List[str]) -> None:
+    """
+    Look up every executable the deployment uses up front.
+    
+    Args:
+        names (List[str]): Names of the executables to find
+    """
+    found = scan_executables(names)
+    _executable_cache.update(found)
+
+    missing = [name for name, path in found.items() if path is None]
+    if missing:
+        logging.info(f"Not yet installed: {missing}")
+
+def clear_executable_cache() -> None:
+    """Forget cached lookups after installing anything that changes PATH."""
+    _executable_cache.clear()
+
 def find_executable(executable: str) -> Optional[str]:
     """
     Find the full path of an executable using shutil.which.
     
+    Results are cached; call clear_executable_cache() after installing
+    anything that changes what is on PATH.
+    
     Args:
         executable (str): Name of the executable to find
     
     Returns:
         Optional[str]: Full path of the executable or None if not found
     """
-    return shutil.which(executable)
+    if executable not in _executable_cache:
+        _executable_cache[executable] = shutil.which(executable)
+    return _executable_cache[executable]
 
-def install_system_dependencies(dependencies: List[str]) -> None:
+def have(executable: str) -> bool:
     """
-    Install system-level dependencies using apt-get.
+    Check whether an executable is available on PATH without spawning it.
     
     Args:
-        dependencies (List[str]): List of dependencies to install
+        executable (str): Name of the executable to check
+    
+    Returns:
+        bool: True if the executable was found
     """
-    missing_deps = [dep for dep in dependencies if not find_executable(dep)]
+    return find_executable(executable) is not None
+
+def apt_cache_is_fresh(max_age: int = APT_CACHE_MAX_AGE) -> bool:
+    """
+    Check whether the apt package index was refreshed recently.
     
-    if missing_deps:
-        logging.info(f"Installing missing system dependencies: {missing_deps}")
-        update_cmd = ["sudo", "apt-get", "update"]
-        install_cmd = ["sudo", "apt-get", "install", "-y"] + missing_deps
-        
-        try:
-            subprocess.run(update_cmd, check=True)
-            subprocess.run(install_cmd, check=True)
-            logging.info("System dependencies installed successfully")
-        except subprocess.CalledProcessError as e:
-            logging.error(f"Failed to install system dependencies: {e}")
-            raise
+    Args:
+        max_age (int): Maximum age of the package cache in seconds
+    
+    Returns:
+        bool: True if the package cache is younger than max_age
+    """
+    try:
+        return time.time() - os.stat(APT_PKGCACHE).st_mtime < max_age
+    except OSError:
+        return False
 
-def install_nodejs(version: str) -> None:
+async def ensure_apt_packages(pkgs: List[str]) -> None:
     """
-    Install Node.js using nodesource repository.
+    Install every missing apt package in a single apt-get transaction.
     
     Args:
-        version (str): Node.js version to install
+        pkgs (List[str]): List of apt packages the deployment needs
     """
-    # Check if Node.js is already installed
-    if find_executable("node"):
-        logging.info("Node.js is already installed")
+    missing_pkgs = [
+        pkg for pkg in pkgs
+        if not have(APT_PACKAGE_EXECUTABLES.get(pkg, pkg))
+    ]
+
+    if not missing_pkgs:
         return
 
-    logging.info(f"Installing Node.js version {version}...")
+    logging.info(f"Installing missing apt packages: {missing_pkgs}")
     try:
-        # Download nodesource setup script
-        subprocess.run([
-            "curl", "-fsSL", 
-            f"https://deb.nodesource.com/setup_{version}.x", 
-            "-o", "nodesource_setup.sh"
-        ], check=True)
+        steps = []
+        if apt_cache_is_fresh():
+            logging.info("apt package index is up to date, skipping apt-get update")
+        else:
+            steps.append("apt-get update")
+        steps.append(f"apt-get install -y {shlex.join(missing_pkgs)}")
+        await run_script(steps, sudo=True)
+        logging.info("apt packages installed successfully")
+    except subprocess.CalledProcessError as e:
+        logging.error(f"Failed to install apt packages: {e}")
+        raise
+    finally:
+        # The install changed what is on PATH
+        clear_executable_cache()
+
+async def download_nodesource_script(version: str) -> Path:
+    """
+    Download the nodesource setup script for the given Node.js version,
+    reusing the cached copy from a previous deployment when present.
+    
+    Args:
+        version (str): Node.js version the setup script is for
+    
+    Returns:
+        Path: Location of the cached setup script
+    """
+    script = CACHE_DIR / f"nodesource_setup_{version}.sh"
+    if script.is_file():
+        logging.info(f"Using cached nodesource setup script {script}")
+        return script
+
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    # Download next to the target and rename so an interrupted transfer
+    # never leaves a truncated script in the cache
+    partial = script.with_suffix(".part")
+    url = f"https://deb.nodesource.com/setup_{version}.x"
+    logging.info(f"Downloading {url}")
+    # urllib rather than curl, so curl can wait for the single apt batch;
+    # the blocking transfer runs in a worker thread
+    await asyncio.to_thread(urllib.request.urlretrieve, url, partial)
+    os.replace(partial, script)
+    return script
+
+async def get_node_major_version() -> Optional[str]:
+    """
+    Get the major version of the installed Node.js.
+    
+    Returns:
+        Optional[str]: Major version (e.g. "23") or None if node is unavailable
+    """
+    if not have("node"):
+        return None
+
+    result = await run_command(["node", "-v"], check=False, capture=True)
+    if result.returncode != 0:
+        return None
+    return result.stdout.strip().lstrip("v").split(".")[0]
+
+async def setup_nodesource_repository(version: str) -> None:
+    """
+    Register the nodesource apt repository so nodejs installs at the given version.
+    
+    Args:
+        version (str): Node.js version to configure the repository for
+    """
+    # Check if the requested Node.js major is already installed
+    installed_major = await get_node_major_version()
+    if installed_major == version.split(".")[0]:
+        logging.info(f"Node.js {version} is already installed")
+        return
+
+    logging.info(f"Configuring nodesource repository for Node.js {version}...")
+    try:
+        # Download (or reuse) nodesource setup script
+        script = await download_nodesource_script(version)
 
         # Run setup script
-        subprocess.run(["sudo", "bash", "nodesource_setup.sh"], check=True)
+        steps = [f"bash {shlex.quote(str(script))}"]
 
-        # Install Node.js and npm
-        subprocess.run(["sudo", "apt-get", "install", "-y", "nodejs"], check=True)
+        # A node of another major is already on PATH, so the batched install
+        # would skip nodejs; upgrade it from the new repository here instead
+        if installed_major is not None:
+            steps.append("apt-get install -y nodejs")
 
-        logging.info("Node.js and npm installed successfully")
-    except subprocess.CalledProcessError as e:
-        logging.error(f"Node.js installation failed: {e}")
+        await run_script(steps, sudo=True)
+
+        logging.info("nodesource repository configured successfully")
+    except (subprocess.CalledProcessError, OSError) as e:
+        logging.error(f"nodesource repository setup failed: {e}")
         raise
-    finally:
-        # Clean up setup script
-        if os.path.exists("nodesource_setup.sh"):
-            os.remove("nodesource_setup.sh")
 
-def install_npm_global_packages(packages: List[str]) -> None:
+def get_npm_env() -> Dict[str, str]:
+    """
+    Build the environment for npm commands, creating the persistent cache
+    directory if needed.
+    
+    Returns:
+        Dict[str, str]: Current environment pointing npm at the persistent cache
+    """
+    NPM_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    return {**os.environ, "npm_config_cache": str(NPM_CACHE_DIR), "CI": "1"}
+
+async def install_npm_global_packages(packages: List[str]) -> None:
     """
     Install global npm packages.
     
     Args:
         packages (List[str]): List of global npm packages to install
     """
-    if not find_executable("npm"):
+    if not have("npm"):
         logging.error("npm is not installed. Cannot install global packages.")
         return
 
-    for package in packages:
-        if not find_executable(package):
+    missing_packages = [package for package in packages if not have(package)]
+    if not missing_packages:
+        return
+
+    # One npm invocation fetches every package in parallel and boots node once
+    try:
+        logging.info(f"Installing global npm packages: {missing_packages}")
+        # Resolve from the persistent npm cache so reinstalls skip the registry
+        try:
+            await run_command(
+                ["npm", "install", "-g", "--prefer-offline", "--no-audit", "--no-fund", *missing_packages],
+                env=get_npm_env()
+            )
+        finally:
+            # The install changed what is on PATH
+            clear_executable_cache()
+        logging.info(f"{', '.join(missing_packages)} installed successfully")
+    except subprocess.CalledProcessError as e:
+        # npm may have installed some packages before failing; name the rest
+        failed_packages = [package for package in missing_packages if not have(package)]
+        for package in failed_packages:
+            logging.error(f"Failed to install {package}: {e}")
+
+def is_empty_dir(path: Path) -> bool:
+    """
+    Check whether a directory is empty, stopping at the first entry.
+    
+    Args:
+        path (Path): Directory to check
+    
+    Returns:
+        bool: True if the directory has no entries
+    """
+    with os.scandir(path) as entries:
+        return next(entries, None) is None
+
+async def update_clone_cache(repo_url: str) -> Path:
+    """
+    Bring the persistent clone of a repository up to date with its remote.
+    
+    A cache that fails local git operations is removed and cloned again.
+    Remote failures are raised and leave the cache for the next deployment.
+    
+    Args:
+        repo_url (str): URL of the git repository
+    
+    Returns:
+        Path: Location of the cached clone
+    """
+    cache_key = hashlib.sha256(repo_url.encode()).hexdigest()
+    cache_dir = CLONE_CACHE_DIR / cache_key
+
+    if (cache_dir / ".git").is_dir():
+        # ls-remote costs one ref line; skip the fetch when the tip
+        # is already cached. It doesn't see new tags, so not when tags are needed
+        remote_sha = None if config.GIT_FETCH_TAGS else await get_remote_head_sha(cache_dir)
+        try:
+            cached_sha = await get_head_sha(cache_dir)
+        except subprocess.CalledProcessError:
+            cached_sha = None
+        if cached_sha is not None:
+            if cached_sha == remote_sha:
+                logging.info("Clone cache is already at the remote HEAD")
+                return cache_dir
+            # Fetch only the new tip and reuse the objects already cached
+            await run_command([
+                "git", "-C", str(cache_dir),
+                "fetch", "--depth=1", *GIT_FETCH_TAG_ARGS, "origin"
+            ])
             try:
-                logging.info(f"Installing global npm package: {package}")
-                subprocess.run(["npm", "install", "-g", package], check=True)
-                logging.info(f"{package} installed successfully")
-            except subprocess.CalledProcessError as e:
-                logging.error(f"Failed to install {package}: {e}")
+                await run_command([
+                    "git", "-C", str(cache_dir),
+                    "reset", "--hard", "origin/HEAD"
+                ])
+                return cache_dir
+            except subprocess.CalledProcessError:
+                pass
+        logging.warning(f"Clone cache {cache_dir} is unusable, cloning it again")
+
+    # Deployment only needs the tip of one branch, not its history.
+    # No blob filter: checkout fetches every tip blob anyway, and
+    # a partial clone can't serve local clones on its own
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    CLONE_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    await run_command([
+        "git", "clone",
+        "--depth=1", "--single-branch", *GIT_CLONE_TAG_ARGS,
+        repo_url, str(cache_dir)
+    ])
+    return cache_dir
 
-def clone_repository(repo_url: str, project_dir: str) -> None:
+async def clone_repository(repo_url: str, project_dir: Path) -> None:
     """
     Clone git repository with error handling.
     
+    The remote is only contacted to update a persistent clone cache; the
+    project directory is then cloned or updated from that cache.
+    
     Args:
         repo_url (str): URL of the git repository
-        project_dir (str): Directory to clone the repository into
+        project_dir (Path): Directory to clone the repository into
     """
     # Ensure project directory exists
-    os.makedirs(project_dir, exist_ok=True)
+    project_dir.mkdir(parents=True, exist_ok=True)
 
     logging.info(f"Cloning repository from {repo_url} to {project_dir}...")
     try:
-        # Check if directory is empty or new
-        if not os.listdir(project_dir):
-            run_command(["git", "clone", repo_url, project_dir])
+        cache_dir = await update_clone_cache(repo_url)
+
+        if (project_dir / ".git").is_dir():
+            # Fetch the new tip from the local cache instead of the remote
+            await run_command([
+                "git", "-C", str(project_dir),
+                "fetch", "--depth=1", *GIT_FETCH_TAG_ARGS, cache_dir.as_uri(), "HEAD"
+            ])
+            await run_command([
+                "git", "-C", str(project_dir),
+                "reset", "--hard", "FETCH_HEAD"
+            ])
+            logging.info("Repository updated successfully")
+        elif is_empty_dir(project_dir):
+            # Cloning from the cache avoids the network. The cache is shallow,
+            # so git copies its objects over a local transport (no hardlinks)
+            await run_command(["git", "clone", *GIT_CLONE_TAG_ARGS, str(cache_dir), str(project_dir)])
+            await run_command([
+                "git", "-C", str(project_dir),
+                "remote", "set-url", "origin", repo_url
+            ])
             logging.info("Repository cloned successfully")
         else:
-            # If directory is not empty, perform a git pull
-            run_command(["git", "pull"], cwd=project_dir)
-            logging.info("Repository updated successfully")
+            raise RuntimeError(f"{project_dir} is not empty and is not a git repository")
     except subprocess.CalledProcessError as e:
         logging.error(f"Repository operation failed: {e}")
         raise
 
-def setup_project(project_dir: str) -> None:
+def hash_file(path: Path) -> str:
+    """
+    Compute the BLAKE2b digest of a file, reading it in chunks.
+    
+    Args:
+        path (Path): Path of the file to hash
+    
+    Returns:
+        str: Hex digest of the file contents
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def link_next_build_cache(project_dir: Path) -> None:
+    """
+    Point the project's .next/cache at its persistent Next.js build cache.
+    
+    Each project gets its own cache, keyed by its path, so apps deployed by
+    the same user don't evict each other's webpack and image caches.
+    
+    Args:
+        project_dir (Path): Directory of the project
+    """
+    cache_key = hashlib.sha256(str(project_dir).encode()).hexdigest()
+    build_cache = NEXT_BUILD_CACHE_DIR / cache_key
+    build_cache.mkdir(parents=True, exist_ok=True)
+    cache_link = project_dir / ".next" / "cache"
+
+    if cache_link.is_symlink():
+        if cache_link.resolve() == build_cache.resolve():
+            return
+        # Linked to another cache, e.g. the shared one earlier versions used
+        cache_link.unlink()
+    elif cache_link.exists():
+        # A cache left by an earlier unlinked build is kept as is
+        return
+
+    cache_link.parent.mkdir(parents=True, exist_ok=True)
+    cache_link.symlink_to(build_cache, target_is_directory=True)
+
+def get_build_heap_size() -> int:
+    """
+    Size the `next build` V8 old-space limit to the machine's memory.
+    
+    Returns:
+        int: Heap limit in MiB, at most NEXT_BUILD_MAX_OLD_SPACE_MB
+    """
+    try:
+        total_mb = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") // (1024 * 1024)
+    except (ValueError, OSError):
+        return NEXT_BUILD_MAX_OLD_SPACE_MB
+    return max(512, min(NEXT_BUILD_MAX_OLD_SPACE_MB, int(total_mb * NEXT_BUILD_MEMORY_FRACTION)))
+
+def get_build_env() -> Dict[str, str]:
+    """
+    Build the environment for `next build`.
+    
+    Settings already present in the environment are left to the operator.
+    
+    Returns:
+        Dict[str, str]: Current environment with build tuning applied
+    """
+    env = dict(os.environ)
+    env.setdefault("NEXT_TELEMETRY_DISABLED", "1")
+    env.setdefault("UV_THREADPOOL_SIZE", str(os.cpu_count() or 4))
+    node_options = env.get("NODE_OPTIONS", "")
+    if "--max-old-space-size" not in node_options:
+        env["NODE_OPTIONS"] = f"{node_options} --max-old-space-size={get_build_heap_size()}".strip()
+    return env
+
+def get_install_command(project: Path) -> Tuple[Optional[Path], List[str]]:
+    """
+    Pick the dependency install command matching the project's lockfile.
+    
+    Args:
+        project (Path): Directory of the project
+    
+    Returns:
+        Tuple[Optional[Path], List[str]]: Lockfile found (None if there is no
+        usable one) and the command that installs from it
+    """
+    for lock_name, command in LOCKFILE_INSTALL_COMMANDS:
+        lock_file = project / lock_name
+        if lock_file.is_file() and have(command[0]):
+            install_cmd = list(command)
+            if config.NPM_IGNORE_SCRIPTS:
+                install_cmd.append("--ignore-scripts")
+            return lock_file, install_cmd
+
+    return None, ["npm", "install"]
+
+async def get_install_key(lock_file: Optional[Path], install_cmd: List[str]) -> str:
+    """
+    Describe everything an installed node_modules depends on.
+    
+    Args:
+        lock_file (Optional[Path]): Lockfile the install resolves from, if any
+        install_cmd (List[str]): Command that installs the dependencies
+    
+    Returns:
+        str: Key that changes whenever node_modules must be reinstalled
+    """
+    # node_modules depends on the install flags and, through native
+    # addons, on the Node.js ABI as well as on the lockfile
+    node_major = await get_node_major_version()
+    lock_hash = hash_file(lock_file) if lock_file is not None else "no-lockfile"
+    return f"{lock_hash} {shlex.join(install_cmd)} node{node_major}"
+
+async def setup_project(project_dir: Path) -> None:
     """
     Setup project dependencies and build.
     
     Args:
-        project_dir (str): Directory of the project
+        project_dir (Path): Directory of the project
     """
     logging.info(f"Setting up project in {project_dir}...")
     
-    # Check for package-lock.json to determine installation method
-    if os.path.exists(os.path.join(project_dir, 'package-lock.json')):
-        run_command(["npm", "ci"], cwd=project_dir)
+    # Check for a lockfile to determine installation method
+    lock_file, install_cmd = get_install_command(project_dir)
+    if lock_file is not None:
+        install_key = await get_install_key(lock_file, install_cmd)
+        install_key_file = project_dir / "node_modules" / INSTALL_KEY_MARKER
+
+        # Skip the install when nothing it depends on changed since the last one
+        if (
+            install_key_file.is_file()
+            and install_key_file.read_text().strip() == install_key
+        ):
+            logging.info(f"{lock_file.name} unchanged, skipping dependency install")
+        else:
+            await run_command(install_cmd, cwd=project_dir, env=get_npm_env())
+            install_key_file.parent.mkdir(exist_ok=True)
+            install_key_file.write_text(install_key)
     else:
-        run_command(["npm", "install"], cwd=project_dir)
+        await run_command(install_cmd, cwd=project_dir, env=get_npm_env())
     
     # Build the project
-    run_command([config.NEXT_BUILD_COMMAND], cwd=project_dir)
+    link_next_build_cache(project_dir)
+    await run_command(
+        shlex.split(config.NEXT_BUILD_COMMAND),
+        cwd=project_dir,
+        env=get_build_env()
+    )
     logging.info("Project setup completed successfully")
 
-def start_application_with_pm2(project_dir: str, app_name: str) -> None:
+async def get_head_sha(project_dir: Path) -> str:
     """
-    Start NextJS application using PM2.
+    Get the commit currently checked out in the project.
     
     Args:
-        project_dir (str): Directory of the project
-        app_name (str): Name to give the PM2 process
+        project_dir (Path): Directory of the project
+    
+    Returns:
+        str: SHA of HEAD
     """
-    logging.info(f"Starting application in {project_dir} using PM2...")
+    result = await run_command(["git", "rev-parse", "HEAD"], cwd=project_dir, capture=True)
+    return result.stdout.strip()
+
+async def get_remote_head_sha(repo_dir: Path) -> Optional[str]:
+    """
+    Ask the remote which commit its HEAD points to, without fetching objects.
+    
+    Args:
+        repo_dir (Path): Directory of a clone with an origin remote
     
-    # Stop existing PM2 process if it exists
+    Returns:
+        Optional[str]: SHA of the remote HEAD or None if it could not be determined
+    """
+    result = await run_command(
+        ["git", "ls-remote", "origin", "HEAD"],
+        cwd=repo_dir,
+        check=False,
+        capture=True
+    )
+    if result.returncode != 0:
+        logging.warning(f"Could not query the remote HEAD: {result.stderr.strip()}")
+        return None
+    fields = result.stdout.split()
+    return fields[0] if fields else None
+
+async def get_deploy_key(project_dir: Path, head_sha: str) -> str:
+    """
+    Describe what a deployment of the project was made from.
+    
+    A redeploy of the same commit still rebuilds and restarts when Node.js
+    or any of the configured commands changed since the last one. The
+    start command and app name also cover the generated PM2 ecosystem file.
+    
+    Args:
+        project_dir (Path): Directory of the project
+        head_sha (str): SHA of the commit being deployed
+    
+    Returns:
+        str: Key recorded in the deploy marker
+    """
+    lock_file, install_cmd = get_install_command(project_dir)
+    return "\n".join([
+        head_sha,
+        await get_install_key(lock_file, install_cmd),
+        config.NEXT_BUILD_COMMAND,
+        config.NEXT_START_COMMAND,
+        config.PM2_APP_NAME,
+    ])
+
+def read_last_deploy_key(project_dir: Path) -> Optional[str]:
+    """
+    Read the key recorded by the last successful deployment.
+    
+    Args:
+        project_dir (Path): Directory of the project
+    
+    Returns:
+        Optional[str]: Key of the last deployment or None if unknown
+    """
     try:
-        run_command(["pm2", "delete", app_name], check=False)
-    except subprocess.CalledProcessError:
-        # Ignore error if process doesn't exist
-        pass
-
-    # Start new PM2 process
-    run_command([
-        "pm2", "start", 
-        config.NEXT_START_COMMAND, 
-        "--name", app_name
-    ], cwd=project_dir)
+        return (project_dir / LAST_DEPLOY_MARKER).read_text()
+    except OSError:
+        return None
+
+def write_last_deploy_key(project_dir: Path, deploy_key: str) -> None:
+    """
+    Record the key of a successful deployment.
+    
+    Args:
+        project_dir (Path): Directory of the project
+        deploy_key (str): Key returned by get_deploy_key()
+    """
+    marker = project_dir / LAST_DEPLOY_MARKER
+    # Write beside the marker and rename so it is never left half-written
+    partial = marker.with_suffix(".tmp")
+    partial.write_text(deploy_key)
+    os.replace(partial, marker)
+
+async def is_pm2_app_running(app_name: str) -> bool:
+    """
+    Check whether PM2 has a running process for the application.
+    
+    Args:
+        app_name (str): Name of the PM2 process
+    
+    Returns:
+        bool: True if the process exists and is online
+    """
+    # `pm2 pid` prints nothing for unknown apps and 0 for stopped ones
+    result = await run_command(["pm2", "pid", app_name], check=False, capture=True)
+    pid = result.stdout.strip()
+    return result.returncode == 0 and pid.isdigit() and pid != "0"
+
+def write_pm2_ecosystem(project_dir: Path, app_name: str) -> Path:
+    """
+    Write the PM2 ecosystem file describing the application.
+    
+    The file lives in the deployment cache rather than the checkout, so it
+    never clashes with an ecosystem file shipped by the repository.
+    
+    Args:
+        project_dir (Path): Directory of the project
+        app_name (str): Name to give the PM2 process
+    
+    Returns:
+        Path: Location of the ecosystem file
+    """
+    script, *args = shlex.split(config.NEXT_START_COMMAND)
+    app = {
+        "name": app_name,
+        "cwd": str(project_dir),
+        "script": script,
+        "args": shlex.join(args),
+    }
+
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    ecosystem = CACHE_DIR / f"ecosystem.{app_name}.config.js"
+    ecosystem.write_text(f"module.exports = {{ apps: [{json.dumps(app)}] }};\n")
+    return ecosystem
+
+async def start_application_with_pm2(project_dir: Path, app_name: str) -> None:
+    """
+    Start NextJS application using PM2, or reload it if it is already running.
+    
+    Args:
+        project_dir (Path): Directory of the project
+        app_name (str): Name to give the PM2 process
+    """
+    logging.info(f"Starting application in {project_dir} using PM2...")
+
+    # A single startOrReload replaces delete + start, saving a pm2 launch.
+    # The app runs in fork mode (npm can't be clustered), where pm2 reloads
+    # by restarting, so the app is still briefly down during a redeploy
+    ecosystem = write_pm2_ecosystem(project_dir, app_name)
+    await run_command(["pm2", "startOrReload", str(ecosystem)], cwd=project_dir)
     
     logging.info("Application started successfully with PM2")
 
-def configure_pm2_startup(username: str) -> None:
+async def configure_pm2_startup(username: str) -> None:
     """
     Configure PM2 to start on system boot.
     
     Args:
         username (str): Username to configure startup for
     """
+    startup_unit = Path(f"/etc/systemd/system/pm2-{username}.service")
+
     try:
+        # The systemd unit persists across deployments, so once it exists
+        # only the process list needs saving, which exec_pm2_save() does
+        if startup_unit.is_file() and startup_unit.stat().st_size > 0:
+            logging.info(f"PM2 startup unit {startup_unit} already exists")
+            return
+
         # Generate startup script
-        run_command(["pm2", "startup"])
+        await run_command(["pm2", "startup"])
         
         # Configure startup for specific user
-        run_command([
-            "sudo", "env", f"PATH={os.environ['PATH']}", 
+        await run_command([
+            "sudo", "env", f"PATH={_PATH}", 
             "pm2", "startup", "systemd", 
             "-u", username, 
-            "--hp", os.path.expanduser("~")
+            "--hp", _HOME
         ])
         
-        # Save current PM2 process list
-        run_command(["pm2", "save"])
-        
         logging.info("PM2 startup configuration completed")
     except subprocess.CalledProcessError as e:
         logging.error(f"PM2 startup configuration failed: {e}")
         raise
 
-def cleanup() -> None:
-    """Perform cleanup tasks after deployment."""
+def exec_pm2_save() -> None:
+    """
+    Replace this process with `pm2 save` to persist the PM2 process list.
+    
+    This is the final deployment step: nothing runs after it, and the
+    interpreter's memory is released as soon as pm2 starts. pm2's own
+    output goes to the console only, not to deployment.log.
+    """
+    logging.info("Saving PM2 process list, output continues on the console")
+    # Flush deployment.log before exec discards our buffers. The atexit hook
+    # must not stop the listener a second time, which raises on Python < 3.12
+    atexit.unregister(log_listener.stop)
+    log_listener.stop()
+    logging.shutdown()
     try:
-        # Remove any temporary files
-        temp_files = ["nodesource_setup.sh"]
-        for file in temp_files:
-            if os.path.exists(file):
-                os.remove(file)
-        
-        logging.info("Cleanup completed")
-    except Exception as e:
-        logging.error(f"Cleanup failed: {e}")
+        os.execvp("pm2", ["pm2", "save"])
+    except OSError as e:
+        # exec failed, so this process is still ours; bring logging back
+        log_listener.start()
+        atexit.register(log_listener.stop)
+        logging.error(f"Could not run pm2 save: {e}")
+        sys.exit(1)
 
-def main():
+async def main():
+    clone_task = None
     try:
-        # Install system dependencies
-        install_system_dependencies([
-            "git", "curl", "software-properties-common"
+        # Resolve the project path once and pass it down
+        project_path = Path(config.PROJECT_DIR).resolve()
+
+        # Locate every tool the deployment uses in one pass over PATH
+        prime_executable_cache([
+            "git", "curl", "node", "npm", "pm2", "add-apt-repository"
         ])
 
-        # Install Node.js
-        install_nodejs(config.NODE_VERSION)
+        # The clone only needs git; when it is already installed, start it now
+        # so its network wait overlaps the Node.js and apt installs below
+        if have("git"):
+            clone_task = asyncio.create_task(
+                clone_repository(config.GITHUB_REPO_URL, project_path)
+            )
 
-        # Install global npm packages
-        install_npm_global_packages(["pm2"])
+        # Register nodesource first so nodejs resolves from it in the batch below
+        await setup_nodesource_repository(config.NODE_VERSION)
 
-        # Clone or update repository
-        clone_repository(config.GITHUB_REPO_URL, config.PROJECT_DIR)
+        # Install every apt package the deployment needs in one transaction
+        await ensure_apt_packages([
+            "git", "curl", "software-properties-common", "nodejs"
+        ])
 
-        # Setup project dependencies and build
-        setup_project(config.PROJECT_DIR)
+        if clone_task is None:
+            clone_task = asyncio.create_task(
+                clone_repository(config.GITHUB_REPO_URL, project_path)
+            )
 
-        # Start application with PM2
-        start_application_with_pm2(config.PROJECT_DIR, config.PM2_APP_NAME)
+        # Finish the clone while the global npm packages install;
+        # both are network-bound and independent of each other. Let both
+        # finish before raising so no command outlives a failed deployment
+        for result in await asyncio.gather(
+            clone_task,
+            install_npm_global_packages(["pm2"]),
+            return_exceptions=True
+        ):
+            if isinstance(result, BaseException):
+                raise result
 
-        # Configure PM2 startup
-        configure_pm2_startup(os.getlogin())
+        # Skip the build when this commit is already deployed with the
+        # same Node.js and commands
+        head_sha = await get_head_sha(project_path)
+        deploy_key = await get_deploy_key(project_path, head_sha)
+        if deploy_key == read_last_deploy_key(project_path):
+            logging.info(f"Commit {head_sha} is already deployed, skipping build")
+            if not await is_pm2_app_running(config.PM2_APP_NAME):
+                await start_application_with_pm2(project_path, config.PM2_APP_NAME)
+        else:
+            # Setup project dependencies and build
+            await setup_project(project_path)
 
-        # Final cleanup
-        cleanup()
+            # Start application with PM2
+            await start_application_with_pm2(project_path, config.PM2_APP_NAME)
+
+            write_last_deploy_key(project_path, deploy_key)
+
+        # Configure PM2 startup
+        await configure_pm2_startup(_USER)
 
-        logging.info("Deployment completed successfully!")
+        logging.info("Deployment steps completed, handing off to pm2 save")
     except Exception as e:
         logging.error(f"Deployment failed: {e}")
+        # Don't exit while the early clone still has git running
+        if clone_task is not None and not clone_task.done():
+            await asyncio.gather(clone_task, return_exceptions=True)
         sys.exit(1)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    asyncio.run(main())
+    exec_pm2_save()
\ No newline at end of file